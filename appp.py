@@ -1,12 +1,19 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS
-from datetime import datetime
 import re
+import hmac
 import os
+import time
 import logging
+import threading
+import orjson
 import requests
-from functools import wraps
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
 
 # ================= CONFIG =================
 
@@ -17,10 +24,85 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 API_KEY = os.environ.get("API_KEY", "demo123")
+API_KEY_BYTES = API_KEY.encode()
 
 GUVI_CALLBACK_URL = "https://hackathon.guvi.in/api/updateHoneyPotFinalResult"
 
-memory = {}
+CALLBACK_WORKERS = 4
+
+# Callbacks run here so requests never wait on GUVI
+CALLBACK_POOL = ThreadPoolExecutor(max_workers=CALLBACK_WORKERS)
+
+# Callbacks queued beyond this are dropped instead of piling up in memory
+CALLBACK_BACKLOG = 256
+CALLBACK_SLOTS = threading.BoundedSemaphore(CALLBACK_BACKLOG)
+
+# Keep-alive connections to GUVI, one per callback worker
+CALLBACK_SESSION = requests.Session()
+CALLBACK_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=CALLBACK_WORKERS,
+    max_retries=Retry(total=2, backoff_factor=0.3)
+))
+
+# Sessions idle for longer than this many seconds are dropped
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 3600))
+
+# Past this many live sessions the least recently used one is evicted
+SESSION_MAX = int(os.environ.get("SESSION_MAX", 10000))
+
+# Only the most recent messages of a session are kept
+SESSION_MAX_MESSAGES = 200
+
+# Stored per message; a tuple is a fraction of the size of a 3-key dict
+Message = namedtuple("Message", "sender text timestamp")
+
+# session_id -> {"seen": last access, "total": count, "messages": deque},
+# oldest first
+memory = OrderedDict()
+
+# Request threads share memory; hold this around every access
+memory_lock = threading.Lock()
+
+# ================= JSON =================
+
+def read_json():
+
+    # Same contract as request.get_json(silent=True), parsed by orjson
+    if not request.is_json:
+        return None
+
+    try:
+        return orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return None
+
+
+def json_response(body, status=200):
+
+    return app.response_class(
+        orjson.dumps(body),
+        status=status,
+        mimetype="application/json"
+    )
+
+
+# ================= TIME =================
+
+# Requests within the same second share one formatted date and time
+@lru_cache(maxsize=1)
+def iso_second(second):
+
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+
+
+def utc_now_iso():
+
+    now = time.time()
+    second = int(now)
+
+    return "%s.%06dZ" % (iso_second(second), (now - second) * 1e6)
+
 
 # ================= AUTH =================
 
@@ -28,83 +110,194 @@ def require_api_key(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
 
-        key = request.headers.get("x-api-key")
+        key = request.environ.get("HTTP_X_API_KEY")
 
-        if not key or key != API_KEY:
-            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        # Constant-time compare so the key can't be guessed by timing
+        if not key or not hmac.compare_digest(key.encode(), API_KEY_BYTES):
+            return json_response({"status": "error", "message": "Unauthorized"}, 401)
 
         return f(*args, **kwargs)
 
     return wrapper
 
 
+# ================= SESSIONS =================
+
+def get_session(session_id):
+
+    # Caller must hold memory_lock
+    now = time.monotonic()
+
+    # Least recently used sessions sit at the front, so expire from there
+    while memory:
+        oldest = next(iter(memory.values()))
+        if now - oldest["seen"] < SESSION_TTL:
+            break
+        memory.popitem(last=False)
+
+    session = memory.get(session_id)
+
+    if session is None:
+        session = memory[session_id] = {
+            "seen": now,
+            "total": 0,
+            "messages": deque(maxlen=SESSION_MAX_MESSAGES)
+        }
+
+        if len(memory) > SESSION_MAX:
+            memory.popitem(last=False)
+    else:
+        memory.move_to_end(session_id)
+        session["seen"] = now
+
+    return session
+
+
 # ================= DETECTION =================
 
-KEYWORDS = [
+# Scammers replay the same scripts, so scan results are memoised per text
+SCAN_CACHE_SIZE = 4096
+
+KEYWORDS = (
     "urgent", "otp", "bank", "upi", "account",
     "verify", "blocked", "payment", "click", "link"
-]
+)
+
+# One alternation for all keywords; the lookahead keeps overlapping hits
+KEYWORD_RE = re.compile("(?=(%s))" % "|".join(map(re.escape, KEYWORDS)))
 
 
-def detect(text):
+@lru_cache(maxsize=SCAN_CACHE_SIZE)
+def scan_keywords(text_lower):
 
-    score = 0
+    found = set(KEYWORD_RE.findall(text_lower))
 
-    for k in KEYWORDS:
-        if k in text.lower():
-            score += 1
+    return tuple(k for k in KEYWORDS if k in found)
+
+
+def detect(text_lower):
+
+    hits = scan_keywords(text_lower)
+    score = len(hits)
 
     if score >= 3:
-        return "Fraud", 95
+        return "Fraud", 95, hits
 
     if score == 0:
-        return "Safe", 80
+        return "Safe", 80, hits
 
-    return "Unknown", 60
+    return "Unknown", 60, hits
 
 
 # ================= INTEL =================
 
-def extract(text):
+# Group names are the intel keys. Order matters: links and UPI ids claim
+# their digits first, and a standalone 10 digit number is a phone, not an account.
+# UPI ids may only start where a [\w.-] run starts, which keeps the scan
+# linear on attacker-supplied text like "a.a.a.a...".
+INTEL_RE = re.compile(
+    r"(?P<phishingLinks>https?://\S+)"
+    r"|(?<![\w.-])[.-]*(?P<upiIds>\w[\w.-]*@[\w.-]+\b)"
+    r"|(?P<phoneNumbers>(?<!\d)(?:\+91)?[6-9]\d{9}(?!\d))"
+    r"|(?P<bankAccounts>\b\d{9,18}\b)"
+)
 
-    intel = {
-        "bankAccounts": re.findall(r"\b\d{9,18}\b", text),
-        "upiIds": re.findall(r"\b[\w\.-]+@[\w\.-]+\b", text),
-        "phishingLinks": re.findall(r"https?://\S+", text),
-        "phoneNumbers": re.findall(r"(?:\+91)?[6-9]\d{9}", text),
-        "suspiciousKeywords": []
-    }
+INTEL_KEYS = ("bankAccounts", "upiIds", "phishingLinks", "phoneNumbers")
+
+# Shared result for messages with nothing to report; never mutate it
+EMPTY_INTEL = {k: () for k in INTEL_KEYS + ("suspiciousKeywords",)}
+
+
+@lru_cache(maxsize=SCAN_CACHE_SIZE)
+def scan_intel(text):
+
+    found = {k: [] for k in INTEL_KEYS}
+
+    for m in INTEL_RE.finditer(text):
+        found[m.lastgroup].append(m.group(m.lastgroup))
+
+    # "919876543210" is the phone "9876543210" written without the "+"
+    if found["phoneNumbers"] and found["bankAccounts"]:
+        phones = {p[-10:] for p in found["phoneNumbers"]}
+        found["bankAccounts"] = [
+            a for a in found["bankAccounts"]
+            if not (len(a) == 12 and a.startswith("91") and a[2:] in phones)
+        ]
 
-    for k in KEYWORDS:
-        if k in text.lower():
-            intel["suspiciousKeywords"].append(k)
+    # Scammers repeat the same number; report each value once, in order
+    return tuple(tuple(dict.fromkeys(found[k])) for k in INTEL_KEYS)
 
-    return intel
+
+def extract(text, hits):
+
+    found = scan_intel(text)
+    has_intel = any(found)
+
+    if not hits and not has_intel:
+        return EMPTY_INTEL, False
+
+    # The cached tuples serialise as JSON arrays, no need to copy them
+    intel = dict(zip(INTEL_KEYS, found))
+
+    intel["suspiciousKeywords"] = hits
+
+    return intel, has_intel
 
 
 # ================= AI =================
 
-def reply(text, history):
+# Triggers are KEYWORDS, checked in priority order against the scan hits
+TRIGGER_REPLIES = (
+    ("otp", "I just got an OTP. Is it safe to share?"),
+    ("bank", "Which bank is this?"),
+    ("click", "What happens if I click?")
+)
+
+FALLBACK_REPLIES = (
+    "Please explain again.",
+    "I am confused.",
+    "What should I do now?",
+    "Can you help me?"
+)
+
+
+def reply(hits, history):
 
-    text = text.lower()
+    for trigger, text in TRIGGER_REPLIES:
+        if trigger in hits:
+            return text
 
-    if "otp" in text:
-        return "I just got an OTP. Is it safe to share?"
+    return FALLBACK_REPLIES[len(history) % len(FALLBACK_REPLIES)]
 
-    if "bank" in text:
-        return "Which bank is this?"
 
-    if "click" in text:
-        return "What happens if I click?"
+# ================= CALLBACK =================
 
-    replies = [
-        "Please explain again.",
-        "I am confused.",
-        "What should I do now?",
-        "Can you help me?"
-    ]
+def send_callback(session_id, intel, total):
 
-    return replies[len(history) % len(replies)]
+    payload = {
+        "sessionId": session_id,
+        "scamDetected": True,
+        "totalMessagesExchanged": total,
+        "extractedIntelligence": intel,
+        "agentNotes": "Scam detected via keyword + behavior"
+    }
+
+    try:
+        CALLBACK_SESSION.post(GUVI_CALLBACK_URL, json=payload, timeout=5)
+        logger.info("GUVI callback sent")
+
+    except Exception as e:
+        logger.error("Callback failed: %s", e)
+
+
+def queue_callback(session_id, intel, total):
+
+    if not CALLBACK_SLOTS.acquire(blocking=False):
+        logger.warning("Callback backlog full, dropped session %s", session_id)
+        return
+
+    future = CALLBACK_POOL.submit(send_callback, session_id, intel, total)
+    future.add_done_callback(lambda _: CALLBACK_SLOTS.release())
 
 
 # ================= HEALTH =================
@@ -112,11 +305,11 @@ def reply(text, history):
 @app.route("/health", methods=["GET"])
 def health():
 
-    return jsonify({
+    return json_response({
         "status": "healthy",
         "service": "Honeypot API",
-        "time": datetime.utcnow().isoformat() + "Z"
-    }), 200
+        "time": iso_second(int(time.time())) + "Z"
+    }, 200)
 
 
 # ================= MAIN API =================
@@ -128,38 +321,42 @@ def analyze():
     try:
 
         # Safe JSON read
-        data = request.get_json(silent=True)
+        data = read_json()
 
         if not isinstance(data, dict):
-            return jsonify({
+            return json_response({
                 "status": "error",
                 "message": "Invalid JSON body"
-            }), 400
+            }, 400)
 
-        logger.info(f"Incoming: {data}")
+        # Full payloads are only formatted when DEBUG logging is on
+        logger.debug("Incoming: %s", data)
 
         # ---------------- Read message ----------------
 
         message = data.get("message", {})
 
         if not isinstance(message, dict):
-            return jsonify({
+            return json_response({
                 "status": "error",
                 "message": "Invalid message format"
-            }), 400
+            }, 400)
 
         text = message.get("text", "")
         sender = message.get("sender", "scammer")
         timestamp = message.get("timestamp")
 
-        if not timestamp:
-            timestamp = datetime.utcnow().isoformat() + "Z"
-
         if not text:
-            return jsonify({
+            return json_response({
                 "status": "error",
                 "message": "Missing message.text"
-            }), 400
+            }, 400)
+
+        # One clock read per request, shared by the user and AI messages
+        now_iso = utc_now_iso()
+
+        if not timestamp:
+            timestamp = now_iso
 
         # ---------------- Session ----------------
 
@@ -167,76 +364,52 @@ def analyze():
 
         history = data.get("conversationHistory", [])
 
-        if session_id not in memory:
-            memory[session_id] = []
-
-        # Save user msg
-        user_msg = {
-            "sender": sender,
-            "text": text,
-            "timestamp": timestamp
-        }
-
-        memory[session_id].append(user_msg)
+        user_msg = Message(sender, text, timestamp)
 
         # ---------------- Process ----------------
 
-        fraud, conf = detect(text)
+        text_lower = text.lower()
 
-        intel = extract(text)
+        fraud, conf, hits = detect(text_lower)
 
-        ai_reply = reply(text, history)
+        intel, has_intel = extract(text, hits)
 
-        # Save AI msg
-        memory[session_id].append({
-            "sender": "ai",
-            "text": ai_reply,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
-        })
+        ai_reply = reply(hits, history)
 
-        # ---------------- Callback ----------------
+        ai_msg = Message("ai", ai_reply, now_iso)
 
-        if fraud == "Fraud" and (
-            intel["upiIds"] or
-            intel["bankAccounts"] or
-            intel["phishingLinks"] or
-            intel["phoneNumbers"]
-        ):
+        # Save user + AI msg together
+        with memory_lock:
+            session = get_session(session_id)
+            session["messages"].extend((user_msg, ai_msg))
+            session["total"] += 2
+            total = session["total"]
 
-            payload = {
-                "sessionId": session_id,
-                "scamDetected": True,
-                "totalMessagesExchanged": len(memory[session_id]),
-                "extractedIntelligence": intel,
-                "agentNotes": "Scam detected via keyword + behavior"
-            }
+        # ---------------- Callback ----------------
 
-            try:
-                requests.post(GUVI_CALLBACK_URL, json=payload, timeout=5)
-                logger.info("GUVI callback sent")
+        if fraud == "Fraud" and has_intel:
 
-            except Exception as e:
-                logger.error(f"Callback failed: {e}")
+            queue_callback(session_id, intel, total)
 
         # ---------------- Response ----------------
 
-        return jsonify({
+        return json_response({
             "status": "success",
             "reply": ai_reply,
             "fraud_status": fraud,
             "confidence": conf,
             "extractedIntelligence": intel
-        }), 200
+        }, 200)
 
 
     except Exception as e:
 
         logger.exception("Analyze error")
 
-        return jsonify({
+        return json_response({
             "status": "error",
             "message": str(e)
-        }), 500
+        }, 500)
 
 
 # ================= RUN =================
@@ -245,8 +418,9 @@ if __name__ == "__main__":
 
     port = int(os.environ.get("PORT", 5000))
 
+    # Local runs only; deploy with gunicorn -c gunicorn_conf.py appp:app
     app.run(
         host="0.0.0.0",
         port=port,
-        debug=True
+        debug=os.environ.get("FLASK_DEBUG") == "1"
     )
@@ -0,0 +1,19 @@
+
+# gunicorn -c gunicorn_conf.py appp:app
+
+import os
+
+# ================= SERVER =================
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "5000")
+
+# Sessions live in each process's memory, so a sessionId must always hit
+# the same worker; more than one worker needs a shared session store
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# Concurrency comes from threads, which share memory under memory_lock
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 8))
+
+# Not preloaded: every worker builds its own callback threads
+preload_app = False